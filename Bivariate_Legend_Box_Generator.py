@@ -10,6 +10,10 @@ from qgis.core import (
     QgsWkbTypes, QgsProcessingException
 )
 from qgis.PyQt.QtGui import QColor
+import re
+
+# Hex color code, with or without the leading '#'
+_HEX_RE = re.compile(r'#?([0-9A-Fa-f]{6})')
 
 # ---------- Color Palettes ----------
 PALETTE_PURPLE_BLUE = {
@@ -119,36 +123,25 @@ class BivariateLegendBoxGenerator(QgsProcessingAlgorithm):
 
     def parse_custom_colors(self, color_string, feedback):
         """Parse comma-separated hex color codes and create a palette dictionary."""
-        # Clean and split the input
-        colors = [c.strip().upper() for c in color_string.split(',')]
+        # Clean, split and validate the input in one pass
+        parts = [c.strip() for c in color_string.split(',')]
+        matches = [_HEX_RE.fullmatch(c) for c in parts]
         
         # Validate we have exactly 9 colors
-        if len(colors) != 9:
+        if len(matches) != 9:
             raise QgsProcessingException(
-                f'Expected 9 hex codes, but got {len(colors)}. '
+                f'Expected 9 hex codes, but got {len(matches)}. '
                 'Please provide exactly 9 colors separated by commas.'
             )
         
         # Validate hex format
-        for i, color in enumerate(colors):
-            if not color.startswith('#'):
-                color = '#' + color
-                colors[i] = color
-            
-            if len(color) != 7:
-                raise QgsProcessingException(
-                    f'Invalid hex code: {color}. '
-                    'Each color must be in format #RRGGBB (e.g., #E9E9EB)'
-                )
-            
-            # Validate hex characters
-            try:
-                int(color[1:], 16)
-            except ValueError:
-                raise QgsProcessingException(
-                    f'Invalid hex code: {color}. '
-                    'Use only valid hexadecimal characters (0-9, A-F)'
-                )
+        if None in matches:
+            raise QgsProcessingException(
+                f'Invalid hex code: {parts[matches.index(None)]}. '
+                'Each color must be in format #RRGGBB (e.g., #E9E9EB)'
+            )
+        
+        colors = ['#' + m.group(1).upper() for m in matches]
         
         # Map colors to bivariate codes (11-33)
         # Order: 11, 12, 13, 21, 22, 23, 31, 32, 33
@@ -4,88 +4,359 @@ from qgis.core import (
     QgsProcessing, QgsProcessingAlgorithm, QgsProcessingParameterRasterLayer,
     QgsProcessingParameterBoolean, QgsProcessingParameterCrs,
     QgsProcessingParameterNumber, QgsProcessingParameterRasterDestination,
-    QgsRasterLayer, QgsProcessingException
+    QgsProcessingException, QgsRasterFileWriter
 )
-import processing
-from osgeo import gdal
+from osgeo import gdal, gdal_array, osr
 import numpy as np
-import os, tempfile
-
-# ---------- Raster calculator helpers ----------
-def _calc_gdal(expr, layer_A, layer_B, out_path, rtype=6):
-    """GDAL raster calculator using variables A,B. Using Float32 (rtype=6) for better compatibility."""
-    params = {
-        'INPUT_A': layer_A, 'BAND_A': 1, 
-        'INPUT_B': layer_B, 'BAND_B': 1,
-        'FORMULA': expr, 
-        'NO_DATA': None, 
-        'RTYPE': rtype, 
-        'OPTIONS': '',
-        'EXTRA': '',
-        'OUTPUT': out_path
-    }
-    return processing.run('gdal:rastercalculator', params)
-
-def _calc_qgis(expr, layers, out_path):
-    """QGIS raster calculator using layer references."""
-    from qgis.core import QgsProcessingContext
-    
-    entries = []
-    layer_dict = {}
-    
-    for idx, layer_path in enumerate(layers):
-        ref_name = chr(65 + idx)  # A, B, C, etc.
-        if isinstance(layer_path, str):
-            layer = QgsRasterLayer(layer_path, f'layer_{ref_name}')
+import os, tempfile, threading, math
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# Creation options for every GeoTIFF written by this script
+_GTIFF_CREATION_OPTIONS = ['COMPRESS=LZW', 'TILED=YES', 'BLOCKXSIZE=512', 'BLOCKYSIZE=512',
+                           'NUM_THREADS=ALL_CPUS']
+
+# Rasters up to this many pixels are kept in memory between quantiles and reclassify
+_MAX_CACHED_PIXELS = 50_000_000
+
+# ---------- In-process raster helpers ----------
+def _output_driver(out_path):
+    """GDAL driver matching the destination's extension, GTiff if unknown."""
+    ext = os.path.splitext(out_path)[1]
+    name = QgsRasterFileWriter.driverForExtension(ext) if ext else ''
+    return gdal.GetDriverByName(name or 'GTiff') or gdal.GetDriverByName('GTiff')
+
+def _create_raster(out_path, cols, rows, geotrans, proj, data_type=gdal.GDT_Byte, nodata=0):
+    """Create a single-band raster with the given georeferencing, in the format
+    implied by out_path. Formats that can't be written block by block (no
+    Create support) get a scratch GeoTIFF that _finish_raster copies over.
+    Always pair with _finish_raster."""
+    driver = _output_driver(out_path)
+    if driver.ShortName == 'GTiff':
+        out_ds = driver.Create(out_path, cols, rows, 1, data_type, options=_GTIFF_CREATION_OPTIONS)
+    elif driver.GetMetadataItem(gdal.DCAP_CREATE) == 'YES':
+        out_ds = driver.Create(out_path, cols, rows, 1, data_type)
+    else:
+        fd, scratch = tempfile.mkstemp(suffix='.tif', prefix='bivar_')
+        os.close(fd)
+        out_ds = gdal.GetDriverByName('GTiff').Create(
+            scratch, cols, rows, 1, data_type, options=_GTIFF_CREATION_OPTIONS)
+    if out_ds is None:
+        raise QgsProcessingException(f"Cannot create output raster: {out_path}")
+    out_ds.SetGeoTransform(geotrans)
+    out_ds.SetProjection(proj)
+    if nodata is not None:
+        out_ds.GetRasterBand(1).SetNoDataValue(nodata)
+    return out_ds
+
+def _finish_raster(out_ds, out_path):
+    """Flush a raster from _create_raster, copying a scratch GeoTIFF to out_path.
+    Closes out_ds, so the caller must not keep other references to it."""
+    out_ds.FlushCache()
+    scratch = out_ds.GetDescription()
+    if os.path.abspath(scratch) == os.path.abspath(out_path):
+        return
+    copy_ds = _output_driver(out_path).CreateCopy(out_path, out_ds)
+    if copy_ds is None:
+        raise QgsProcessingException(f"Cannot create output raster: {out_path}")
+    copy_ds = None
+    out_ds = None
+    gdal.GetDriverByName('GTiff').Delete(scratch)
+
+def _raster_info(path, cache):
+    """(geotransform, cols, rows, srs WKT) of path, memoised in cache per (path, mtime).
+    cache is a dict owned by one run, so concurrent runs never share or clear it."""
+    key = (path, os.path.getmtime(path) if os.path.exists(path) else None)
+    info = cache.get(key)
+    if info is None:
+        ds = gdal.Open(path)
+        if ds is None:
+            raise QgsProcessingException(f"Cannot open raster: {path}")
+        info = (ds.GetGeoTransform(), ds.RasterXSize, ds.RasterYSize, ds.GetProjection())
+        cache[key] = info
+    return info
+
+def _on_grid(path, gt_ref, cache, tol=1e-6):
+    """True if path has gt_ref's pixel size and its origin is a whole number of
+    pixels away from gt_ref's, i.e. a plain window of it lands on gt_ref's grid."""
+    gt = _raster_info(path, cache)[0]
+    px, py = gt_ref[1], gt_ref[5]
+    if not (math.isclose(gt[1], px, rel_tol=tol) and math.isclose(gt[5], py, rel_tol=tol)):
+        return False
+    dx, dy = (gt_ref[0] - gt[0]) / px, (gt_ref[3] - gt[3]) / py
+    return abs(dx - round(dx)) <= tol and abs(dy - round(dy)) <= tol
+
+def _same_crs(path, crs, cache):
+    """True if the raster at path is already in the QGIS CRS crs."""
+    wkt = _raster_info(path, cache)[3]
+    if not wkt:
+        return False
+    src_srs = osr.SpatialReference()
+    src_srs.ImportFromWkt(wkt)
+    t_srs = osr.SpatialReference()
+    t_srs.ImportFromWkt(crs.toWkt())
+    return bool(src_srs.IsSame(t_srs))
+
+def _open_raster(path):
+    """Open a raster with GDAL. Callers take bands from the returned dataset and
+    must keep it referenced while using them: before GDAL 3.8 a Python band does
+    not keep its dataset alive, so a dropped dataset leaves a dangling band."""
+    ds = gdal.Open(path)
+    if ds is None:
+        raise QgsProcessingException(f"Cannot open raster: {path}")
+    return ds
+
+def _reclass_block(arr, nd, q1, q2):
+    """Classify arr into 1/2/3 around the terciles q1, q2 as uint8.
+    0 marks NoData so it can't be mistaken for class 1. Runs on pool workers, so it
+    stays single-threaded NumPy (searchsorted releases the GIL)."""
+    # Branchless binning in one pass; side='left' keeps the "<= q" class boundaries.
+    # Terciles are pixel values of this raster, so its own dtype holds them exactly
+    edges = np.array([q1, q2], dtype=arr.dtype)
+    cls = np.searchsorted(edges, arr, side='left').astype(np.uint8)
+    cls += 1
+    cls[_invalid_mask(arr, nd)] = 0
+    return cls
+
+def _combine_block(ca, cb):
+    """Combine class arrays into bivariate codes ca*10+cb (0 where either is NoData)."""
+    # Stays uint8 throughout (max code 33), so no widened temporaries
+    bivar = ca * np.uint8(10)
+    bivar += cb
+    bivar[(ca == 0) | (cb == 0)] = 0
+    return bivar
+
+def _classify_tiled(sources, out_paths, cols, rows, feedback, max_workers=None):
+    """Reclassify both rasters and combine them tile by tile on a thread pool.
+
+    sources holds one dict per raster (A, B) with keys path, arr, nd, q1, q2;
+    arr is the cached array or None to read tiles from path. out_paths is
+    (a_class, b_class, bivar); each class raster takes its source's gt/proj and
+    the bivariate raster takes A's. Workers read and compute; only this thread
+    writes, since a GDAL dataset must not be written from several threads at once."""
+    a, b = sources
+    out_ds = [_create_raster(p, cols, rows, src['gt'], src['proj'])
+              for p, src in zip(out_paths, (a, b, a))]
+    out_bands = [ds.GetRasterBand(1) for ds in out_ds]
+    # Windows follow the first output's native blocks (512x512 tiles for GeoTIFF and
+    # scratch outputs, the driver's default layout otherwise); one A/B read per window
+    # feeds all three outputs
+    windows = list(_iter_blocks(out_bands[0]))
+
+    # GDAL handles aren't thread-safe either, so each worker opens its own
+    local = threading.local()
+
+    def read(src, key, win):
+        xoff, yoff, xs, ys = win
+        if src['arr'] is not None:
+            return src['arr'][yoff:yoff + ys, xoff:xoff + xs]
+        band = getattr(local, key, None)
+        if band is None:
+            ds = _open_raster(src['path'])
+            band = ds.GetRasterBand(1)
+            setattr(local, key + '_ds', ds)
+            setattr(local, key, band)
+            setattr(local, key + '_bufs', {})
+        # Reuse one read buffer per tile shape; the tile is fully consumed by
+        # _reclass_block before this thread reads its next one
+        bufs = getattr(local, key + '_bufs')
+        buf = bufs.get((ys, xs))
+        if buf is None:
+            dtype = gdal_array.GDALTypeCodeToNumericTypeCode(band.DataType)
+            buf = bufs[(ys, xs)] = np.empty((ys, xs), dtype=dtype)
+        return band.ReadAsArray(xoff, yoff, xs, ys, buf_obj=buf)
+
+    def job(win):
+        ca = _reclass_block(read(a, 'a', win), a['nd'], a['q1'], a['q2'])
+        cb = _reclass_block(read(b, 'b', win), b['nd'], b['q1'], b['q2'])
+        return win, (ca, cb, _combine_block(ca, cb))
+
+    written = 0
+
+    def write(result):
+        nonlocal written
+        (xoff, yoff, _, _), tiles = result
+        for band, tile in zip(out_bands, tiles):
+            band.WriteArray(tile, xoff, yoff)
+        written += 1
+        feedback.setProgress(100 * written / len(windows))
+
+    max_workers = max_workers or os.cpu_count() or 1
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        for win in windows:
+            if feedback.isCanceled():
+                break
+            pending.append(pool.submit(job, win))
+            # Bound the tiles held in memory while the writer catches up
+            if len(pending) >= 2 * max_workers:
+                write(pending.popleft().result())
+        while pending:
+            write(pending.popleft().result())
+
+    # Hand each dataset over so _finish_raster holds the last reference and
+    # can close it before removing any scratch file
+    out_bands = None
+    for p in out_paths:
+        _finish_raster(out_ds.pop(0), p)
+
+def _iter_blocks(band, min_rows=256):
+    """Yield (xoff, yoff, xsize, ysize) windows aligned to the band's native blocks.
+    Strip-organised rasters (one-row blocks) are grouped into taller windows."""
+    bx, by = band.GetBlockSize()
+    cols, rows = band.XSize, band.YSize
+    if bx >= cols:
+        by = by * max(1, min_rows // by)
+    for yoff in range(0, rows, by):
+        ys = min(by, rows - yoff)
+        for xoff in range(0, cols, bx):
+            yield xoff, yoff, min(bx, cols - xoff), ys
+
+def _invalid_mask(arr, nd):
+    """Boolean mask of NaN and nodata pixels."""
+    invalid = np.isnan(arr)
+    if nd is not None:
+        invalid |= arr == nd
+    return invalid
+
+def _read_valid(band, nd, xoff, yoff, xs, ys):
+    """Read one window and return its valid (non-NaN, non-nodata) pixels.
+    Kept in the band's native dtype, like the cached path, so streamed terciles
+    are exact pixel values and classify identically whatever the raster size."""
+    arr = band.ReadAsArray(xoff, yoff, xs, ys)
+    return arr[~_invalid_mask(arr, nd)]
+
+def _tercile_ranks(n):
+    """0-based order-statistic positions of the two terciles among n values."""
+    return int(n * 0.33333), int(n * 0.66667)
+
+def _array_terciles(vals):
+    """Exact terciles of an in-memory array of valid pixels."""
+    if vals.size == 0:
+        raise QgsProcessingException("No valid pixels to compute quantiles")
+    k1, k2 = _tercile_ranks(vals.size)
+    part = np.partition(vals, [k1, k2])
+    return part[k1], part[k2]
+
+def _bin_index(vals, lo, scale, bins):
+    """Equal-width bin of each value, counted from lo. Computed in float64 so a
+    tiny range can't overflow the scale; monotonic, so each bin is a value interval."""
+    return np.minimum(((vals.astype(np.float64) - float(lo)) * scale).astype(np.int64), bins - 1)
+
+def _stream_histogram(band, nd, lo, hi, bins):
+    """Histogram of the valid pixels in [lo, hi]; returns (counts, scale).
+    lo and hi must be finite, which also keeps +-inf pixels out of the bins."""
+    scale = bins / (float(hi) - float(lo))
+    hist = np.zeros(bins, dtype=np.int64)
+    for win in _iter_blocks(band):
+        vals = _read_valid(band, nd, *win)
+        vals = vals[(vals >= lo) & (vals <= hi)]
+        hist += np.bincount(_bin_index(vals, lo, scale, bins), minlength=bins)
+    return hist, scale
+
+def _stream_select(band, nd, ks, lo, hi, hist, scale, bins, max_collect):
+    """k-th smallest (0-based) valid pixel among those in [lo, hi], for each k in ks,
+    given their histogram.
+
+    Only the bins holding the ranks are collected, all in one pass. A bin with more
+    than max_collect pixels (zero-inflated data, few distinct values, a huge value
+    range) is first narrowed to its actual [min, max] and histogrammed again, so
+    memory stays bounded by len(ks) * max_collect whatever the distribution."""
+    cum = np.cumsum(hist)
+    targets = []
+    for k in ks:
+        b = int(np.searchsorted(cum, k + 1))
+        targets.append((b, k - (int(cum[b - 1]) if b > 0 else 0)))
+
+    small = sorted({b for b, _ in targets if hist[b] <= max_collect})
+    parts = {b: [] for b in small}
+    if small:
+        for win in _iter_blocks(band):
+            vals = _read_valid(band, nd, *win)
+            vals = vals[(vals >= lo) & (vals <= hi)]
+            idx = _bin_index(vals, lo, scale, bins)
+            for b in small:
+                parts[b].append(vals[idx == b])
+    collected = {b: np.concatenate(p) for b, p in parts.items()}
+
+    out = []
+    for b, k in targets:
+        if b in collected:
+            out.append(np.partition(collected[b], k)[k])
+            continue
+        blo, bhi = np.inf, -np.inf
+        for win in _iter_blocks(band):
+            vals = _read_valid(band, nd, *win)
+            vals = vals[(vals >= lo) & (vals <= hi)]
+            vals = vals[_bin_index(vals, lo, scale, bins) == b]
+            if vals.size:
+                blo, bhi = min(blo, vals.min()), max(bhi, vals.max())
+        if blo == bhi:
+            out.append(blo)
+            continue
+        sub_hist, sub_scale = _stream_histogram(band, nd, blo, bhi, bins)
+        out.append(_stream_select(band, nd, [k], blo, bhi, sub_hist, sub_scale,
+                                  bins, max_collect)[0])
+    return out
+
+def _stream_terciles(band, nd, bins=4096, max_collect=1 << 22):
+    """Exact terciles of a band without loading it whole.
+
+    Pass 1 finds the finite value range and counts +-inf pixels, pass 2 builds a
+    histogram of the finite values, then _stream_select picks the terciles from
+    the bins that hold them. Infinite pixels take the lowest/highest ranks, as
+    they do in np.partition on the cached path."""
+    vmin, vmax, n, n_neg, n_pos = np.inf, -np.inf, 0, 0, 0
+    for win in _iter_blocks(band):
+        vals = _read_valid(band, nd, *win)
+        n += vals.size
+        n_neg += int(np.count_nonzero(vals == -np.inf))
+        n_pos += int(np.count_nonzero(vals == np.inf))
+        vals = vals[np.isfinite(vals)]
+        if vals.size:
+            vmin, vmax = min(vmin, vals.min()), max(vmax, vals.max())
+
+    if n == 0:
+        raise QgsProcessingException("No valid pixels to compute quantiles")
+
+    q = {}
+    finite_ks = []
+    for k in _tercile_ranks(n):
+        if k < n_neg:
+            q[k] = -np.inf
+        elif k >= n - n_pos:
+            q[k] = np.inf
+        elif vmin == vmax:
+            q[k] = vmin
         else:
-            layer = layer_path
-            
-        if not layer.isValid():
-            raise QgsProcessingException(f"Invalid layer: {layer_path}")
-            
-        from qgis.analysis import QgsRasterCalculatorEntry
-        entry = QgsRasterCalculatorEntry()
-        entry.ref = f'{ref_name}@1'
-        entry.raster = layer
-        entry.bandNumber = 1
-        entries.append(entry)
-        layer_dict[ref_name] = layer
-    
-    from qgis.analysis import QgsRasterCalculator
-    calc = QgsRasterCalculator(
-        expr,
-        out_path,
-        'GTiff',
-        layer_dict['A'].extent(),
-        layer_dict['A'].width(),
-        layer_dict['A'].height(),
-        entries
-    )
-    
-    result = calc.processCalculation()
-    if result != 0:
-        raise QgsProcessingException(f"Raster calculation failed with code: {result}")
-    
-    return {'OUTPUT': out_path}
+            finite_ks.append(k)
 
-def _runcalc_dual(qgis_expr, gdal_expr, layers, out_path, feedback):
-    """Try GDAL calc first (more reliable); fall back to QGIS calc."""
-    A = layers[0]
-    B = layers[1] if len(layers) > 1 else layers[0]
-    
-    try:
-        feedback.pushInfo(f"Attempting GDAL calculation: {gdal_expr}")
-        return _calc_gdal(gdal_expr, A, B, out_path)
-    except Exception as e_gdal:
-        feedback.pushWarning(f"GDAL calculator failed: {str(e_gdal)}")
-        try:
-            feedback.pushInfo(f"Attempting QGIS calculation: {qgis_expr}")
-            return _calc_qgis(qgis_expr, layers, out_path)
-        except Exception as e_qgis:
-            raise QgsProcessingException(
-                f"Raster calculator failed in both GDAL and QGIS.\n"
-                f"GDAL error: {e_gdal}\nQGIS error: {e_qgis}"
-            )
+    if finite_ks:
+        hist, scale = _stream_histogram(band, nd, vmin, vmax, bins)
+        picked = _stream_select(band, nd, [k - n_neg for k in finite_ks],
+                                vmin, vmax, hist, scale, bins, max_collect)
+        q.update(zip(finite_ks, picked))
+    k1, k2 = _tercile_ranks(n)
+    return q[k1], q[k2]
+
+def load_and_quantiles(path, max_cached_pixels=_MAX_CACHED_PIXELS):
+    """Terciles of band 1 of path, plus the loaded array for reuse by the reclassify step.
+
+    Returns (arr, nd, q1, q2, geotrans, proj, cols, rows). Rasters larger than
+    max_cached_pixels are not held in memory: terciles are streamed block by
+    block and arr is None."""
+    ds = _open_raster(path)
+    band = ds.GetRasterBand(1)
+    nd = band.GetNoDataValue()
+    cols, rows = ds.RasterXSize, ds.RasterYSize
+
+    if cols * rows <= max_cached_pixels:
+        arr = band.ReadAsArray()
+        q1, q2 = _array_terciles(arr[~_invalid_mask(arr, nd)])
+    else:
+        arr = None
+        q1, q2 = _stream_terciles(band, nd)
+    return arr, nd, q1, q2, ds.GetGeoTransform(), ds.GetProjection(), cols, rows
 
 
 # ---------- Processing Algorithm ----------
@@ -121,8 +392,9 @@ class BivariateRasterGenerator(QgsProcessingAlgorithm):
             'and apply color styles to the output.\n\n'
             'Options:\n'
             '- Optionally aligns grids to match Raster A\n'
-            '- Optionally divides Raster B by a factor (useful for unit conversion)\n'
-            '- Outputs: Individual class rasters (1-3) and combined bivariate raster (11-33)'
+            '- Optionally divides Raster B by a factor (useful for unit conversion; '
+            'rescales the reported terciles, classes are unchanged)\n'
+            '- Outputs: Individual class rasters (1-3) and combined bivariate raster (11-33), as Byte rasters with NoData=0'
         )
 
     def initAlgorithm(self, config=None):
@@ -172,40 +444,50 @@ class BivariateRasterGenerator(QgsProcessingAlgorithm):
 
             tmpdir = tempfile.mkdtemp(prefix='bivar_')
             feedback.pushInfo(f"Working directory: {tmpdir}")
+            # Raster metadata read during this run only
+            info_cache = {}
 
             # ---------- Reproject & Align ----------
-            def warp_to_match(src, dst, ref, t_srs, feedback):
+            def warp_to_match(src, dst, ref, t_srs, feedback, resampling='bilinear'):
+                """Warp src into t_srs. With a ref raster, snap to its extent and resolution;
+                without one, let gdalwarp derive them in the target CRS.
+                resampling is a GDAL -r name ('bilinear', 'near', ...)."""
                 feedback.pushInfo(f"Warping {os.path.basename(src)} to match reference")
-                ref_ds = gdal.Open(ref)
-                if ref_ds is None:
-                    raise QgsProcessingException(f"Cannot open reference raster: {ref}")
-                
-                gt = ref_ds.GetGeoTransform()
-                px, py = abs(gt[1]), abs(gt[5])
-                minx, maxy = gt[0], gt[3]
-                cols, rows = ref_ds.RasterXSize, ref_ds.RasterYSize
-                maxx, miny = minx + cols * px, maxy - rows * py
-                
-                target_extent_str = f"{minx},{maxx},{miny},{maxy}"
+                bounds, px, py = None, None, None
+                if ref is not None:
+                    gt, cols, rows, _ = _raster_info(ref, info_cache)
+                    px, py = abs(gt[1]), abs(gt[5])
+                    minx, maxy = gt[0], gt[3]
+                    maxx, miny = minx + cols * px, maxy - rows * py
+                    bounds = (minx, miny, maxx, maxy)
+                    
+                    # Same CRS: a windowed resample is enough, no reprojection pipeline needed.
+                    # With 'near', Translate snaps projWin to whole source pixels and would
+                    # keep src's origin, so take it only when the grids already line up.
+                    if (_same_crs(src, t_srs, info_cache) and
+                            (resampling != 'near' or _on_grid(src, gt, info_cache))):
+                        out_ds = gdal.Translate(
+                            dst, src, format='GTiff',
+                            projWin=[minx, maxy, maxx, miny], xRes=px, yRes=py,
+                            resampleAlg=resampling, outputType=gdal.GDT_Float32,
+                            creationOptions=_GTIFF_CREATION_OPTIONS)
+                        if out_ds is None:
+                            raise QgsProcessingException(f"Cannot translate raster: {src}")
+                        out_ds = None
+                        return {'OUTPUT': dst}
                 
-                args = {
-                    'INPUT': src,
-                    'SOURCE_CRS': None,
-                    'TARGET_CRS': t_srs,
-                    'RESAMPLING': 1,  # Bilinear
-                    'NODATA': None,
-                    'TARGET_EXTENT': target_extent_str,
-                    'TARGET_EXTENT_CRS': t_srs,
-                    'TARGET_RESOLUTION': px,
-                    'OPTIONS': '',
-                    'DATA_TYPE': 6,  # Float32
-                    'MULTITHREADING': True,
-                    'OUTPUT': dst
-                }
-                
-                result = processing.run('gdal:warpreproject', args, context=context, feedback=feedback)
-                ref_ds = None
-                return result
+                # OPTIMIZE_SIZE=NO keeps the pre-GDAL 3.8 chunking, avoiding pixel-shift surprises
+                out_ds = gdal.Warp(
+                    dst, src, format='GTiff',
+                    dstSRS=t_srs.toWkt(), outputBounds=bounds, xRes=px, yRes=py,
+                    resampleAlg=resampling, outputType=gdal.GDT_Float32,
+                    multithread=True, warpMemoryLimit=1024 * 1024 * 1024,
+                    creationOptions=_GTIFF_CREATION_OPTIONS,
+                    warpOptions=['NUM_THREADS=ALL_CPUS', 'OPTIMIZE_SIZE=NO'])
+                if out_ds is None:
+                    raise QgsProcessingException(f"Cannot warp raster: {src}")
+                out_ds = None
+                return {'OUTPUT': dst}
 
             path_a = raster_a.source()
             path_b = raster_b.source()
@@ -213,70 +495,71 @@ class BivariateRasterGenerator(QgsProcessingAlgorithm):
 
             if do_align:
                 feedback.pushInfo("Aligning rasters...")
-                a_ref = os.path.join(tmpdir, 'A_ref.tif')
-                warp_to_match(path_a, a_ref, path_a, final_crs, feedback)
+                # Raster A only needs warping when it is being reprojected
+                if final_crs != raster_a.crs():
+                    a_al = os.path.join(tmpdir, 'A_aligned.tif')
+                    warp_to_match(path_a, a_al, None, final_crs, feedback)
+                else:
+                    a_al = path_a
                 
-                a_al = os.path.join(tmpdir, 'A_aligned.tif')
-                warp_to_match(a_ref, a_al, a_ref, final_crs, feedback)
+                # B already on A's resolution only needs snapping: nearest avoids
+                # a second interpolation that would smear values before classification
+                resampling = 'bilinear'
+                if _same_crs(path_b, final_crs, info_cache):
+                    gt_ref, gt_src = _raster_info(a_al, info_cache)[0], _raster_info(path_b, info_cache)[0]
+                    if (math.isclose(abs(gt_src[1]), abs(gt_ref[1]), rel_tol=1e-6) and
+                            math.isclose(abs(gt_src[5]), abs(gt_ref[5]), rel_tol=1e-6)):
+                        resampling = 'near'
                 
                 b_al = os.path.join(tmpdir, 'B_aligned.tif')
-                warp_to_match(path_b, b_al, a_al, final_crs, feedback)
+                warp_to_match(path_b, b_al, a_al, final_crs, feedback, resampling)
             else:
                 a_al, b_al = path_a, path_b
 
             # ---------- Optional divide Raster B ----------
+            # Dividing by a positive constant is monotonic: classifying B/k against
+            # terciles of B/k gives the same classes as B against terciles of B. So B
+            # is never rewritten; the divisor only scales the reported terciles.
             b_input = b_al
+            b_scale = 1.0 / divisor_b if apply_div_b else 1.0
             if apply_div_b:
-                feedback.pushInfo(f"Dividing Raster B by {divisor_b}")
-                b_scaled = os.path.join(tmpdir, 'B_scaled.tif')
-                _runcalc_dual(f'"B@1"/{divisor_b}', f'B/{divisor_b}', [b_al], b_scaled, feedback)
-                b_input = b_scaled
+                feedback.pushInfo(f"Dividing Raster B by {divisor_b} (applied to terciles)")
 
             # ---------- Compute quantiles (terciles) ----------
-            def quantiles(path, feedback):
-                feedback.pushInfo(f"Computing quantiles for {os.path.basename(path)}")
-                ds = gdal.Open(path)
-                if ds is None:
-                    raise QgsProcessingException(f"Cannot open raster: {path}")
-                
-                band = ds.GetRasterBand(1)
-                arr = band.ReadAsArray().astype('float64')
-                nd = band.GetNoDataValue()
-                
-                if nd is not None:
-                    arr[arr == nd] = np.nan
-                
-                vals = arr[~np.isnan(arr)]
-                ds = None
-                
-                if vals.size == 0:
-                    raise QgsProcessingException("No valid pixels to compute quantiles")
-                
-                q1, q2 = np.percentile(vals, [33.333, 66.667])
-                feedback.pushInfo(f"  Q1: {q1:.4f}, Q2: {q2:.4f}")
-                return q1, q2
-
-            a_q1, a_q2 = quantiles(a_al, feedback)
-            b_q1, b_q2 = quantiles(b_input, feedback)
+            feedback.pushInfo(f"Computing quantiles for {os.path.basename(a_al)}")
+            arr_a, nd_a, a_q1, a_q2, gt_a, prj_a, Wa, Ha = load_and_quantiles(a_al)
+            feedback.pushInfo(f"  Q1: {a_q1:.4f}, Q2: {a_q2:.4f}")
 
-            # ---------- Reclassify to 1/2/3 ----------
-            feedback.pushInfo("Reclassifying Raster A...")
-            qgis_expr_A = f'("A@1"<={a_q1})*1 + (("A@1">{a_q1}) * ("A@1"<={a_q2}))*2 + ("A@1">{a_q2})*3'
-            gdal_expr_A = f'(A<={a_q1})*1 + ((A>{a_q1})*(A<={a_q2}))*2 + (A>{a_q2})*3'
-            _runcalc_dual(qgis_expr_A, gdal_expr_A, [a_al], out_a_class, feedback)
+            feedback.pushInfo(f"Computing quantiles for {os.path.basename(b_input)}")
+            arr_b, nd_b, b_q1, b_q2, gt_b, prj_b, Wb, Hb = load_and_quantiles(b_input)
+            feedback.pushInfo(f"  Q1: {b_q1 * b_scale:.4f}, Q2: {b_q2 * b_scale:.4f}")
 
-            feedback.pushInfo("Reclassifying Raster B...")
-            qgis_expr_B = f'("B@1"<={b_q1})*1 + (("B@1">{b_q1}) * ("B@1"<={b_q2}))*2 + ("B@1">{b_q2})*3'
-            gdal_expr_B = f'(B<={b_q1})*1 + ((B>{b_q1})*(B<={b_q2}))*2 + (B>{b_q2})*3'
-            _runcalc_dual(qgis_expr_B, gdal_expr_B, [b_input], out_b_class, feedback)
+            if (Wa, Ha) != (Wb, Hb):
+                raise QgsProcessingException(
+                    "Raster A and Raster B have different dimensions. "
+                    "Enable 'Reproject & align to Raster A grid' to match them."
+                )
+            if do_align and not all(math.isclose(x, y, rel_tol=1e-9, abs_tol=1e-9 * abs(gt_a[1]))
+                                    for x, y in zip(gt_a, gt_b)):
+                raise QgsProcessingException(
+                    f"Aligned Raster B grid {tuple(gt_b)} does not match Raster A grid {tuple(gt_a)}."
+                )
 
-            # ---------- Combine into 11..33 ----------
-            feedback.pushInfo("Combining into bivariate classes...")
-            _runcalc_dual('"A@1"*10+"B@1"', '(A*10)+B', [out_a_class, out_b_class], out_bivar, feedback)
+            # ---------- Reclassify to 1/2/3 and combine into 11..33 ----------
+            feedback.pushInfo("Reclassifying rasters and combining into bivariate classes...")
+            _classify_tiled(
+                [dict(path=a_al, arr=arr_a, nd=nd_a, q1=a_q1, q2=a_q2, gt=gt_a, proj=prj_a),
+                 dict(path=b_input, arr=arr_b, nd=nd_b, q1=b_q1, q2=b_q2, gt=gt_b, proj=prj_b)],
+                (out_a_class, out_b_class, out_bivar), Wa, Ha, feedback)
+            arr_a = arr_b = None
+            # A cancel stops _classify_tiled part-way: don't pass the partial rasters off as results
+            if feedback.isCanceled():
+                feedback.pushInfo('Canceled: outputs are incomplete.')
+                return {}
 
             feedback.pushInfo('='*50)
             feedback.pushInfo(f'Raster A Terciles: q1={a_q1:.4f}, q2={a_q2:.4f}')
-            feedback.pushInfo(f'Raster B Terciles: q1={b_q1:.4f}, q2={b_q2:.4f}')
+            feedback.pushInfo(f'Raster B Terciles: q1={b_q1 * b_scale:.4f}, q2={b_q2 * b_scale:.4f}')
             feedback.pushInfo('='*50)
             feedback.pushInfo('Bivariate raster generated successfully!')
             feedback.pushInfo('Use "Bivariate Style Generator" to apply colors.')
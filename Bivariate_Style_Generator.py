@@ -7,6 +7,10 @@ from qgis.core import (
     QgsProcessingException
 )
 import processing
+import re
+
+# Hex color code, with or without the leading '#'
+_HEX_RE = re.compile(r'#?([0-9A-Fa-f]{6})')
 
 # ---------- Color Palettes ----------
 PALETTE_PURPLE_BLUE = [
@@ -39,43 +43,51 @@ COLOR_PALETTES = {
 }
 
 # ---------- QML writer ----------
+_QML_HEADER = (
+    "<!DOCTYPE qgis PUBLIC 'http://mrcc.com/qgis.dtd' 'SYSTEM'>\n"
+    '<qgis autoRefreshTime="0" version="3.22.0-Bialowieza" '
+    'styleCategories="LayerConfiguration|Symbology|MapTips|AttributeTable|Rendering|CustomProperties|Temporal|Elevation|Notes" '
+    'maxScale="0" autoRefreshMode="Disabled" hasScaleBasedVisibilityFlag="0" minScale="1e+08">\n'
+    '  <flags><Identifiable>1</Identifiable><Removable>1</Removable><Searchable>1</Searchable></flags>\n'
+    '  <pipe>\n'
+    '    <provider><resampling zoomedOutResamplingMethod="nearestNeighbour" enabled="false" '
+    'zoomedInResamplingMethod="nearestNeighbour" maxOversampling="2"/></provider>\n'
+    '    <rasterrenderer opacity="1" band="1" type="paletted" alphaBand="-1" nodataColor="">\n'
+    '      <rasterTransparency/>\n'
+    '      <colorPalette>\n'
+)
+
+_QML_FOOTER = (
+    '      </colorPalette>\n'
+    '      <colorramp type="randomcolors" name="[source]"/>\n'
+    '    </rasterrenderer>\n'
+    '    <brightnesscontrast brightness="0" contrast="0" gamma="1"/>\n'
+    '    <rasterresampler maxOversampling="2"/>\n'
+    '  </pipe>\n'
+    '  <blendMode>0</blendMode>\n'
+    '</qgis>\n'
+)
+
+def _qml_palette_body(items):
+    """Render palette entries as QML <paletteEntry> lines."""
+    return ''.join(
+        f'        <paletteEntry alpha="255" label="{label}" color="{hexcolor}" value="{val}"/>\n'
+        for (val, label, hexcolor) in items
+    )
+
+# Built-in palettes never change, so render their bodies once at import
+_PRECOMPUTED_BODIES = {key: _qml_palette_body(items) for key, items in COLOR_PALETTES.items()}
+
 def write_bivariate_qml(qml_path, palette_key='purple_blue', custom_palette=None):
     """Writes a QGIS paletted raster style (.qml) using a selected color palette or custom colors."""
     # Use custom palette if provided, otherwise use predefined palette
     if custom_palette:
-        items = custom_palette
+        body = _qml_palette_body(custom_palette)
     else:
-        items = COLOR_PALETTES.get(palette_key, PALETTE_PURPLE_BLUE)
+        body = _PRECOMPUTED_BODIES.get(palette_key, _PRECOMPUTED_BODIES['purple_blue'])
 
-    doctype = "<!DOCTYPE qgis PUBLIC 'http://mrcc.com/qgis.dtd' 'SYSTEM'>\n"
-    header = (
-        '<qgis autoRefreshTime="0" version="3.22.0-Bialowieza" '
-        'styleCategories="LayerConfiguration|Symbology|MapTips|AttributeTable|Rendering|CustomProperties|Temporal|Elevation|Notes" '
-        'maxScale="0" autoRefreshMode="Disabled" hasScaleBasedVisibilityFlag="0" minScale="1e+08">\n'
-        '  <flags><Identifiable>1</Identifiable><Removable>1</Removable><Searchable>1</Searchable></flags>\n'
-        '  <pipe>\n'
-        '    <provider><resampling zoomedOutResamplingMethod="nearestNeighbour" enabled="false" '
-        'zoomedInResamplingMethod="nearestNeighbour" maxOversampling="2"/></provider>\n'
-        '    <rasterrenderer opacity="1" band="1" type="paletted" alphaBand="-1" nodataColor="">\n'
-        '      <rasterTransparency/>\n'
-        '      <colorPalette>\n'
-    )
-    body = ''.join(
-        f'        <paletteEntry alpha="255" label="{label}" color="{hexcolor}" value="{val}"/>\n'
-        for (val, label, hexcolor) in items
-    )
-    footer = (
-        '      </colorPalette>\n'
-        '      <colorramp type="randomcolors" name="[source]"/>\n'
-        '    </rasterrenderer>\n'
-        '    <brightnesscontrast brightness="0" contrast="0" gamma="1"/>\n'
-        '    <rasterresampler maxOversampling="2"/>\n'
-        '  </pipe>\n'
-        '  <blendMode>0</blendMode>\n'
-        '</qgis>\n'
-    )
     with open(qml_path, 'w', encoding='utf-8') as f:
-        f.write(doctype + header + body + footer)
+        f.write(_QML_HEADER + body + _QML_FOOTER)
     return qml_path
 
 
@@ -153,36 +165,25 @@ class BivariateStyleGenerator(QgsProcessingAlgorithm):
 
     def parse_custom_colors(self, color_string, feedback):
         """Parse comma-separated hex color codes and create a palette list."""
-        # Clean and split the input
-        colors = [c.strip().upper() for c in color_string.split(',')]
+        # Clean, split and validate the input in one pass
+        parts = [c.strip() for c in color_string.split(',')]
+        matches = [_HEX_RE.fullmatch(c) for c in parts]
         
         # Validate we have exactly 9 colors
-        if len(colors) != 9:
+        if len(matches) != 9:
             raise QgsProcessingException(
-                f'Expected 9 hex codes, but got {len(colors)}. '
+                f'Expected 9 hex codes, but got {len(matches)}. '
                 'Please provide exactly 9 colors separated by commas.'
             )
         
         # Validate hex format
-        for i, color in enumerate(colors):
-            if not color.startswith('#'):
-                color = '#' + color
-                colors[i] = color
-            
-            if len(color) != 7:
-                raise QgsProcessingException(
-                    f'Invalid hex code: {color}. '
-                    'Each color must be in format #RRGGBB (e.g., #E9E9EB)'
-                )
-            
-            # Validate hex characters
-            try:
-                int(color[1:], 16)
-            except ValueError:
-                raise QgsProcessingException(
-                    f'Invalid hex code: {color}. '
-                    'Use only valid hexadecimal characters (0-9, A-F)'
-                )
+        if None in matches:
+            raise QgsProcessingException(
+                f'Invalid hex code: {parts[matches.index(None)]}. '
+                'Each color must be in format #RRGGBB (e.g., #E9E9EB)'
+            )
+        
+        colors = ['#' + m.group(1).upper() for m in matches]
         
         # Map colors to bivariate codes (11-33)
         codes = [11, 12, 13, 21, 22, 23, 31, 32, 33]